@@ -1,184 +1,810 @@
 #!/usr/bin/env python3
 
 
+import os
+import select
+import selectors
 import socket
 import threading
+import queue
 import struct
 import json
 import logging
 import argparse
-from urllib.parse import urlparse
+import collections
+import concurrent.futures
+import http.client
+from urllib.parse import urlsplit
 import ssl
 import time
 
+try:
+    import httptools
+except ImportError:
+    httptools = None
+
+# What parse_request raises for a request that isn't valid HTTP.
+REQUEST_PARSE_ERRORS = (ValueError, httptools.HttpParserError) if httptools is not None else (ValueError,)
+
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Sized for the bandwidth-delay product of a high-latency satellite link.
+LINK_BUFFER_SIZE = 12 * 1024 * 1024
+# Cap unsent data queued in the kernel so one bulk response can't delay later frames.
+LINK_NOTSENT_LOWAT = 64 * 1024
+# Probe an idle link after 30 s and give up after 3 unanswered probes 10 s apart.
+LINK_KEEPIDLE = 30
+LINK_KEEPINTVL = 10
+LINK_KEEPCNT = 3
+
+RECV_CHUNK_SIZE = 64 * 1024
+
+UPSTREAM_TIMEOUT = 30
+
+# A tunnel whose target accepts no ship data for this long is torn down.
+TUNNEL_WRITE_TIMEOUT = 30
+# Ship frames queued for a tunnel's target before the tunnel is dropped (about 4 MiB).
+TUNNEL_BACKLOG = 64
+# How often a paused sender checks whether it was closed meanwhile.
+FLOW_POLL_INTERVAL = 1
+# A streamed response paused this long is abandoned; the ship gives up on its client sooner.
+STREAM_PAUSE_TIMEOUT = 120
+
+# Upstream bodies larger than this, or of unknown length, are streamed to the
+# ship instead of buffered.
+STREAM_THRESHOLD = 64 * 1024
+
+MSG_REQUEST = 0
+MSG_RESPONSE = 1
+MSG_BODY = 2
+MSG_TUNNEL_OPEN = 3
+MSG_TUNNEL_DATA = 4
+MSG_TUNNEL_CLOSE = 5
+# Status line and headers only; the body follows as MSG_BODY frames ended by an empty one.
+MSG_RESPONSE_HEAD = 6
+# Ship -> offshore flow control for one tunnel or streamed response, keyed by its id.
+MSG_PAUSE = 7
+MSG_RESUME = 8
+# Ship -> offshore: the client has gone, so stop answering this request.
+MSG_CANCEL = 9
+
+# 4-byte length, 1-byte type, 4-byte request id; tunnels reuse their CONNECT's id.
+FRAME_HEADER = struct.Struct('>IBI')
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+
+# Upstream fetches that may run at once for pipelined requests.
+UPSTREAM_WORKERS = 32
+
+# Lets the kernel coalesce a frame header with the payload spliced in after it.
+SEND_MORE = getattr(socket, 'MSG_MORE', 0)
+
+def build_error_response(status_code, status_text):
+    
+    body = f"<html><body><h1>{status_code} {status_text}</h1></body></html>".encode('utf-8')
+    head = f"HTTP/1.1 {status_code} {status_text}\r\nContent-Type: text/html\r\nContent-Length: {len(body)}\r\n\r\n"
+    return head.encode('utf-8') + body
+
+# Built once at import; these are the responses the proxy itself sends.
+ERROR_RESPONSES = {
+    (status_code, status_text): build_error_response(status_code, status_text)
+    for status_code, status_text in [
+        (400, "Bad Request"),
+        (400, "Bad Request - No host specified"),
+        (500, "Internal Server Error"),
+        (502, "Bad Gateway"),
+        (504, "Gateway Timeout"),
+    ]
+}
+
+class _RequestCallbacks:
+    
+    def __init__(self):
+        self.url = b''
+        self.headers = []
+        self.body = bytearray()
+
+    def on_url(self, url):
+        self.url += url
+
+    def on_header(self, name, value):
+        self.headers.append((name.decode('latin-1'), value.decode('latin-1')))
+
+    def on_body(self, body):
+        self.body += body
+
+def parse_request(request_data):
+    """Split a raw HTTP request into (method, url, headers, body).
+
+    Only the request head is decoded; the body is a view into request_data
+    unless it had to be de-chunked.
+    """
+    head_end = request_data.find(b'\r\n\r\n')
+    if head_end == -1:
+        raise ValueError("Incomplete request head")
+    view = memoryview(request_data)
+
+    if httptools is not None:
+        callbacks = _RequestCallbacks()
+        parser = httptools.HttpRequestParser(callbacks)
+        try:
+            # Only the head goes through the parser unless the body is chunked.
+            parser.feed_data(view[:head_end + 4])
+            headers = callbacks.headers
+            chunked = any(name.lower() == 'transfer-encoding' for name, _ in headers)
+            if chunked:
+                parser.feed_data(view[head_end + 4:])
+        except httptools.HttpParserUpgrade:
+            headers, chunked = callbacks.headers, False
+
+        body = view[head_end + 4:]
+        # The parser hands over a de-chunked body, so describe it by length instead.
+        if chunked:
+            headers = [(name, value) for name, value in headers if name.lower() not in ('transfer-encoding', 'content-length')]
+            headers.append(('Content-Length', str(len(callbacks.body))))
+            body = callbacks.body
+
+        return parser.get_method().decode('latin-1'), callbacks.url.decode('latin-1'), headers, body
+
+    request_line, *header_lines = bytes(request_data[:head_end]).decode('latin-1').split('\r\n')
+    method, url, version = request_line.split(' ', 2)
+    headers = [(name.strip(), value.strip()) for name, _, value in
+               (line.partition(':') for line in header_lines)]
+    return method, url, headers, view[head_end + 4:]
+
+def set_keepalive(sock):
+    
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, LINK_KEEPIDLE)
+    elif hasattr(socket, 'TCP_KEEPALIVE'):
+        # macOS name for the idle time.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, LINK_KEEPIDLE)
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, LINK_KEEPINTVL)
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, LINK_KEEPCNT)
+
+def frame_header(msg_type, req_id, length):
+    
+    return FRAME_HEADER.pack(length, msg_type, req_id)
+
+def wait_readable(sock, timeout=None):
+    """Block until sock is readable; False if timeout (seconds) ran out first."""
+    # poll() rather than select(), which can't watch fds numbered 1024 and up.
+    poller = select.poll()
+    poller.register(sock, select.POLLIN)
+    return bool(poller.poll(None if timeout is None else timeout * 1000))
+
+def splice_frame(link, msg_type, req_id, read_fd, length):
+    """Send a frame whose payload is the next length bytes waiting in a pipe."""
+    header = frame_header(msg_type, req_id, length)
+    with link.send_lock:
+        link.sock.sendall(header, SEND_MORE)
+        while length:
+            length -= os.splice(read_fd, link.sock.fileno(), length)
+
+def sendmsg_all(sock, buffers, flags=0):
+    
+    if not hasattr(sock, 'sendmsg'):
+        for buf in buffers:
+            sock.sendall(buf)
+        return
+
+    # Vectored send; on a short write drop what went out and resend the rest.
+    views = [memoryview(buf) for buf in buffers]
+    while views:
+        sent = sock.sendmsg(views, [], flags)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views:
+            views[0] = views[0][sent:]
+
+class FrameReader:
+    """Reads length-prefixed frames from a ship connection.
+
+    Each recv pulls up to RECV_CHUNK_SIZE bytes, so a small frame's header and
+    body usually arrive in one syscall; leftover bytes are kept for the next frame.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._rxbuf = bytearray()
+        self._scratch = bytearray(RECV_CHUNK_SIZE)
+        self._view = memoryview(self._scratch)
+
+    def fill(self):
+        
+        n = self.sock.recv_into(self._scratch)
+        if not n:
+            return False
+        self._rxbuf += self._view[:n]
+        return True
+
+    def next_frame(self):
+        
+        if len(self._rxbuf) < FRAME_HEADER_SIZE:
+            return None
+
+        length, msg_type, req_id = FRAME_HEADER.unpack_from(self._rxbuf, 0)
+        end = FRAME_HEADER_SIZE + length
+        if len(self._rxbuf) < end:
+            return None
+
+        payload = self._rxbuf[FRAME_HEADER_SIZE:end]
+        del self._rxbuf[:end]
+        return msg_type, req_id, payload
+
+class ConnectionPool:
+    """Idle keep-alive upstream connections keyed by (scheme, host, port).
+
+    Hosts are evicted least-recently-used once more than max_hosts are pooled.
+    """
+
+    def __init__(self, max_hosts=32, max_idle=8):
+        self.max_hosts = max_hosts
+        self.max_idle = max_idle
+        self._idle = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, scheme, host, port):
+        """Return (connection, reused)."""
+        key = (scheme, host, port)
+        with self._lock:
+            conns = self._idle.get(key)
+            if conns:
+                self._idle.move_to_end(key)
+                return conns.pop(), True
+
+        conn_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return conn_class(host, port, timeout=UPSTREAM_TIMEOUT), False
+
+    def put(self, scheme, host, port, conn):
+        
+        key = (scheme, host, port)
+        evicted = []
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+            else:
+                evicted.append(conn)
+            while len(self._idle) > self.max_hosts:
+                evicted.extend(self._idle.popitem(last=False)[1])
+
+        for conn in evicted:
+            conn.close()
+
+    def close(self):
+        
+        with self._lock:
+            idle = [conn for conns in self._idle.values() for conn in conns]
+            self._idle.clear()
+        for conn in idle:
+            conn.close()
+
+class Flow:
+    """Whether the ship wants more data for one tunnel or streamed response right now."""
+    
+    def __init__(self):
+        self.resumed = threading.Event()
+        self.resumed.set()
+        self.closed = False
+
+    def pause(self):
+        if not self.closed:
+            self.resumed.clear()
+
+    def resume(self):
+        self.resumed.set()
+
+    def close(self):
+        self.closed = True
+        self.resumed.set()
+
+    def wait(self, timeout=None):
+        """Block while paused; False once the flow is closed or stayed paused for timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # A pause racing close() is caught by the periodic recheck.
+        while not self.resumed.wait(FLOW_POLL_INTERVAL):
+            if self.closed or (deadline is not None and time.monotonic() > deadline):
+                return False
+        return not self.closed
+
+class Tunnel:
+    
+    def __init__(self, sock):
+        self.sock = sock
+        # Ship -> target data, written by the tunnel's own thread so a target
+        # that stops reading only stalls its own tunnel.
+        self.outbound = queue.Queue(TUNNEL_BACKLOG)
+        # Target -> ship data stops while the ship's client is behind.
+        self.flow = Flow()
+
+class ShipLink:
+    
+    def __init__(self, sock):
+        self.sock = sock
+        self.frames = FrameReader(sock)
+        self.send_lock = threading.Lock()
+        self.tunnels = {}
+        # Flow of each request still being answered, by id; MSG_CANCEL closes it.
+        self.requests = {}
+        # Tunnel opens still connecting on the worker pool; a close from the
+        # ship removes the id so open_tunnel drops the target instead.
+        self.opening = set()
+        self.tunnel_lock = threading.Lock()
+
 class OffshoreProxy:
-    def __init__(self, host='0.0.0.0', port=9999):
+    def __init__(self, host='0.0.0.0', port=9999, sndbuf=LINK_BUFFER_SIZE, rcvbuf=LINK_BUFFER_SIZE, workers=UPSTREAM_WORKERS):
         self.host = host
         self.port = port
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
         self.socket = None
+        self.selector = None
         self.running = False
+        self.pool = ConnectionPool()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upstream')
 
     def start(self):
         
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Set on the listener so the window scale is negotiated for the
+            # accepted ship connection; target sockets keep kernel autotuning.
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
             self.socket.bind((self.host, self.port))
-            self.socket.listen(1)
+            self.socket.listen(128)
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.socket, selectors.EVENT_READ)
             self.running = True
 
             logger.info(f"Offshore proxy listening on {self.host}:{self.port}")
 
+            # One thread multiplexes the listener and every ship connection;
+            # the timeout lets stop() take effect.
             while self.running:
-                try:
-                    conn, addr = self.socket.accept()
-                    logger.info(f"Connection established with ship proxy: {addr}")
-                    self.handle_ship_connection(conn)
-                except socket.error as e:
-                    if self.running:
-                        logger.error(f"Socket error: {e}")
+                for key, _ in self.selector.select(timeout=1):
+                    if key.fileobj is self.socket:
+                        self.accept_ship_connection()
+                    else:
+                        self.read_ship_connection(key.data)
 
         except Exception as e:
             logger.error(f"Failed to start server: {e}")
         finally:
             self.cleanup()
 
-    def handle_ship_connection(self, conn):
+    def accept_ship_connection(self):
         
         try:
-            while self.running:
-                
-                header = self._recv_all(conn, 5)
-                if not header:
-                    break
+            conn, addr = self.socket.accept()
+        except socket.error as e:
+            if self.running:
+                logger.error(f"Socket error: {e}")
+            return
 
-                length = struct.unpack('>I', header[:4])[0]
-                msg_type = header[4]
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if hasattr(socket, 'TCP_NOTSENT_LOWAT'):
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NOTSENT_LOWAT, LINK_NOTSENT_LOWAT)
+        set_keepalive(conn)
 
-                if msg_type != 0: 
-                    logger.warning(f"Unexpected message type: {msg_type}")
-                    continue
-
-                
-                request_data = self._recv_all(conn, length)
-                if not request_data:
-                    break
+        logger.info(f"Connection established with ship proxy: {addr}")
+        self.selector.register(conn, selectors.EVENT_READ, ShipLink(conn))
 
-               
-                response = self.process_request(request_data)
+    def read_ship_connection(self, link):
+        
+        try:
+            if not link.frames.fill():
+                self.close_ship_connection(link)
+                return
 
-                
-                self.send_message(conn, 1, response)
+            while (frame := link.frames.next_frame()) is not None:
+                self.handle_frame(link, *frame)
 
         except Exception as e:
             logger.error(f"Error handling ship connection: {e}")
-        finally:
-            conn.close()
-            logger.info("Ship connection closed")
+            self.close_ship_connection(link)
 
-    def process_request(self, request_data):
-        """Process HTTP request and return response"""
+    def handle_frame(self, link, msg_type, req_id, payload):
+        
+        # Runs on the selector thread for every ship, so nothing here may block:
+        # requests and tunnel opens go to the worker pool and tunnel data to the
+        # tunnel's writer thread.
+        if msg_type == MSG_REQUEST:
+            # Registered here so a cancel that overtakes the fetch still finds it.
+            link.requests[req_id] = Flow()
+            self.executor.submit(self.handle_request_frame, link, req_id, payload)
+
+        elif msg_type == MSG_TUNNEL_OPEN:
+            link.opening.add(req_id)
+            self.executor.submit(self.open_tunnel, link, req_id, payload)
+
+        elif msg_type == MSG_TUNNEL_DATA:
+            tunnel = link.tunnels.get(req_id)
+            if tunnel is not None:
+                try:
+                    tunnel.outbound.put_nowait(payload)
+                except queue.Full:
+                    logger.error(f"Tunnel {req_id} target is not keeping up; closing it")
+                    self.shutdown_tunnel(tunnel)
+
+        elif msg_type in (MSG_PAUSE, MSG_RESUME):
+            tunnel = link.tunnels.get(req_id)
+            flow = tunnel.flow if tunnel is not None else link.requests.get(req_id)
+            if flow is not None:
+                if msg_type == MSG_PAUSE:
+                    flow.pause()
+                else:
+                    flow.resume()
+
+        elif msg_type == MSG_CANCEL:
+            flow = link.requests.get(req_id)
+            if flow is not None:
+                flow.close()
+
+        elif msg_type == MSG_TUNNEL_CLOSE:
+            with link.tunnel_lock:
+                tunnel = link.tunnels.pop(req_id, None)
+                link.opening.discard(req_id)
+            if tunnel is not None:
+                self.shutdown_tunnel(tunnel)
+
+        else:
+            logger.warning(f"Unexpected message type: {msg_type}")
+
+    def close_ship_connection(self, link):
+        
+        self.selector.unregister(link.sock)
+        for tunnel in list(link.tunnels.values()):
+            self.shutdown_tunnel(tunnel)
+        for flow in list(link.requests.values()):
+            flow.close()
+        link.tunnels.clear()
+        link.sock.close()
+        logger.info("Ship connection closed")
+
+    def handle_request_frame(self, link, req_id, request_data):
+        
+        flow = link.requests.get(req_id)
         try:
-            request_str = request_data.decode('utf-8')
-            lines = request_str.split('\r\n')
-            request_line = lines[0]
+            if flow is None or flow.closed:
+                logger.info(f"Request {req_id} cancelled by the ship before it was fetched")
+                return
+            response = self.process_request(request_data, (link, req_id, flow))
+            if response is None or flow.closed:
+                # Already streamed to the ship, or nobody is waiting for it any more.
+                return
+            try:
+                self.send_message(link, MSG_RESPONSE, req_id, response)
+            except OSError as e:
+                logger.error(f"Failed to send response {req_id}: {e}")
+        finally:
+            link.requests.pop(req_id, None)
 
-            method, url, version = request_line.split(' ', 2)
+    def open_tunnel(self, link, tunnel_id, request_data):
+        
+        response, target_sock = self.handle_connect_request(request_data)
+        # Register before answering: the ship starts sending as soon as it sees the 200.
+        tunnel = None
+        with link.tunnel_lock:
+            if tunnel_id not in link.opening:
+                # The ship gave up on this CONNECT while we were connecting.
+                if target_sock is not None:
+                    target_sock.close()
+                logger.info(f"Tunnel {tunnel_id} closed by the ship before it opened")
+                return
+            link.opening.discard(tunnel_id)
+            if target_sock is not None:
+                tunnel = link.tunnels[tunnel_id] = Tunnel(target_sock)
+        try:
+            self.send_message(link, MSG_RESPONSE, tunnel_id, response)
+        except OSError as e:
+            logger.error(f"Failed to send tunnel response {tunnel_id}: {e}")
+        if tunnel is not None:
+            threading.Thread(target=self.pump_tunnel, args=(link, tunnel_id, tunnel), daemon=True).start()
+
+    def process_request(self, request_data, stream_to=None):
+        """Process HTTP request and return response, or None if it was streamed to stream_to"""
+        try:
+            method, url, headers, body = parse_request(request_data)
+        except REQUEST_PARSE_ERRORS as e:
+            logger.warning(f"Malformed request: {e}")
+            return self.create_error_response(400, "Bad Request")
 
+        try:
             if method == 'CONNECT':
                 
-                return self.handle_connect_request(url)
+                return self.create_error_response(400, "Bad Request")
             else:
                 
-                return self.handle_http_request(request_str, url)
+                return self.handle_http_request(method, url, headers, body, stream_to)
 
         except Exception as e:
             logger.error(f"Error processing request: {e}")
             return self.create_error_response(500, "Internal Server Error")
 
-    def handle_http_request(self, request_str, url):
+    def handle_http_request(self, method, url, headers, body, stream_to=None):
         
         try:
-            parsed_url = urlparse(url)
+            parsed_url = urlsplit(url)
+            scheme = parsed_url.scheme or 'http'
             host = parsed_url.hostname
-            port = parsed_url.port or (443 if parsed_url.scheme == 'https' else 80)
+            port = parsed_url.port
 
             if not host:
                 
-                lines = request_str.split('\r\n')
-                for line in lines[1:]:
-                    if line.lower().startswith('host:'):
-                        host = line.split(':', 1)[1].strip()
+                for name, value in headers:
+                    if name.lower() == 'host':
+                        host_header = urlsplit('//' + value)
+                        host, port = host_header.hostname, host_header.port
                         break
 
             if not host:
                 return self.create_error_response(400, "Bad Request - No host specified")
 
-            
-            target_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            target_sock.settimeout(30)
-            target_sock.connect((host, port))
-
-            
-            target_sock.sendall(request_str.encode('utf-8'))
+            port = port or (443 if scheme == 'https' else 80)
+            # urlsplit keeps ;params in the path, so the origin sees the target as sent.
+            path = parsed_url.path or '/'
+            if parsed_url.query:
+                path += '?' + parsed_url.query
 
-            
-            response = b''
-            target_sock.settimeout(5)
-            while True:
-                try:
-                    chunk = target_sock.recv(4096)
-                    if not chunk:
-                        break
-                    response += chunk
-                except socket.timeout:
-                    break
-
-            target_sock.close()
-            return response
+            resp, body = self.fetch(scheme, host, port, method, path, headers, body, stream_to)
+            if body is None:
+                return None
+            return self.build_response(resp, body)
 
         except Exception as e:
             logger.error(f"Error handling HTTP request: {e}")
             return self.create_error_response(502, "Bad Gateway")
 
-    def handle_connect_request(self, target):
+    def fetch(self, scheme, host, port, method, path, headers, body, stream_to=None):
+        """Return (resp, body); body is None when the response was streamed to stream_to."""
+        has_host = any(name.lower() == 'host' for name, _ in headers)
+        while True:
+            conn, reused = self.pool.get(scheme, host, port)
+            try:
+                conn.putrequest(method, path, skip_host=has_host, skip_accept_encoding=True)
+                for name, value in headers:
+                    conn.putheader(name, value)
+                conn.endheaders(body or None)
+
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # The server dropped an idle pooled connection; retry once on a fresh one.
+                if reused:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+
+            try:
+                # length is None for chunked and close-delimited bodies, 0 when there is no body.
+                if stream_to is not None and (resp.length is None or resp.length > STREAM_THRESHOLD):
+                    self.stream_response(*stream_to, conn, resp)
+                    resp_body = None
+                else:
+                    resp_body = resp.read()
+            except Exception:
+                conn.close()
+                raise
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self.pool.put(scheme, host, port, conn)
+            return resp, resp_body
+
+    def stream_response(self, link, req_id, flow, conn, resp):
+        
+        self.send_message(link, MSG_RESPONSE_HEAD, req_id, self.build_stream_head(resp))
+
+        if resp.length is not None and hasattr(os, 'splice') and not isinstance(conn.sock, ssl.SSLSocket):
+            # Whatever http.client buffered past the headers has to go out first.
+            # The makefile() buffer is smaller than one chunk, so a single read1 drains it.
+            remaining = resp.length
+            buffered = resp.fp.read1(min(remaining, RECV_CHUNK_SIZE))
+            if buffered:
+                self.send_message(link, MSG_BODY, req_id, buffered)
+            self._splice_body(link, req_id, conn.sock, remaining - len(buffered), flow)
+            # Body consumed behind http.client's back; let it close out the response.
+            resp.length = 0
+            resp.read()
+        else:
+            # readinto() de-chunks, so the ship gets the same raw body frames either way.
+            buf = bytearray(RECV_CHUNK_SIZE)
+            view = memoryview(buf)
+            while n := resp.readinto(buf):
+                self.wait_for_ship(flow, req_id)
+                self.send_message(link, MSG_BODY, req_id, view[:n])
+
+        self.send_message(link, MSG_BODY, req_id)
+
+    def _splice_body(self, link, req_id, sock, remaining, flow):
+        
+        # Upstream body goes socket -> pipe -> ship socket without entering Python.
+        read_fd, write_fd = os.pipe()
+        try:
+            while remaining:
+                self.wait_for_ship(flow, req_id)
+                try:
+                    n = os.splice(sock.fileno(), write_fd, min(remaining, RECV_CHUNK_SIZE))
+                except BlockingIOError:
+                    # Upstream sockets have a timeout, so their fd is non-blocking.
+                    if not wait_readable(sock, UPSTREAM_TIMEOUT):
+                        raise socket.timeout("Timed out reading upstream body")
+                    continue
+                if not n:
+                    raise http.client.IncompleteRead(b'', remaining)
+                remaining -= n
+                splice_frame(link, MSG_BODY, req_id, read_fd, n)
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def wait_for_ship(self, flow, req_id):
+        
+        # Holds only this worker while the ship's client catches up.
+        if not flow.wait(STREAM_PAUSE_TIMEOUT):
+            if flow.closed:
+                raise ConnectionAbortedError(f"Response {req_id} cancelled by the ship")
+            raise ConnectionAbortedError(f"Ship stopped taking response {req_id}")
+
+    def build_response(self, resp, body):
+        
+        headers = resp.getheaders()
+
+        # resp.read() has already de-chunked the body, so re-frame it with a Content-Length.
+        if resp.chunked:
+            headers = [(name, value) for name, value in headers if name.lower() != 'transfer-encoding']
+            headers.append(('Content-Length', str(len(body))))
+        elif body and resp.getheader('Content-Length') is None:
+            headers.append(('Content-Length', str(len(body))))
+
+        response = self.build_head(resp, headers)
+        response += body
+        return response
+
+    def build_stream_head(self, resp):
+        
+        headers = resp.getheaders()
+        if resp.length is None:
+            # The body goes out de-chunked and its length is unknown, so the client
+            # reads it to end of connection; the ship closes after every response.
+            headers = [(name, value) for name, value in headers
+                       if name.lower() not in ('transfer-encoding', 'content-length', 'connection')]
+            headers.append(('Connection', 'close'))
+        return self.build_head(resp, headers)
+
+    def build_head(self, resp, headers):
+        
+        version = 'HTTP/1.0' if resp.version == 10 else 'HTTP/1.1'
+        head = bytearray(f"{version} {resp.status} {resp.reason}\r\n".encode('latin-1'))
+        for name, value in headers:
+            head += f"{name}: {value}\r\n".encode('latin-1')
+        head += b"\r\n"
+        return head
+
+    def handle_connect_request(self, request_data):
         
         try:
-            
-            response = "HTTP/1.1 200 Connection Established\r\n\r\n"
-            return response.encode('utf-8')
+            request_line = bytes(request_data).split(b'\r\n', 1)[0].decode('latin-1')
+            method, target, version = request_line.split(' ', 2)
+            host, _, port = target.rpartition(':')
+            if not host:
+                host, port = port, '443'
+
+            target_sock = socket.create_connection((host.strip('[]'), int(port)), timeout=30)
+            target_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # The timeout bounds the writer's sendall; the pump treats read timeouts as idle.
+            target_sock.settimeout(TUNNEL_WRITE_TIMEOUT)
+
+            logger.info(f"Tunnel established to {host}:{port}")
+            return b"HTTP/1.1 200 Connection Established\r\n\r\n", target_sock
         except Exception as e:
             logger.error(f"Error handling CONNECT request: {e}")
-            return self.create_error_response(502, "Bad Gateway")
+            return self.create_error_response(502, "Bad Gateway"), None
 
-    def create_error_response(self, status_code, status_text):
+    def pump_tunnel(self, link, tunnel_id, tunnel):
+        
+        writer = threading.Thread(target=self.write_tunnel, args=(link, tunnel_id, tunnel), daemon=True)
+        writer.start()
+        try:
+            if hasattr(os, 'splice'):
+                self._splice_tunnel(link, tunnel_id, tunnel)
+            else:
+                self._copy_tunnel(link, tunnel_id, tunnel)
+        except OSError as e:
+            if tunnel_id in link.tunnels:
+                logger.error(f"Tunnel {tunnel_id} failed: {e}")
+        finally:
+            if link.tunnels.pop(tunnel_id, None) is not None:
+                try:
+                    self.send_message(link, MSG_TUNNEL_CLOSE, tunnel_id)
+                except OSError:
+                    pass
+            self.shutdown_tunnel(tunnel)
+            writer.join()
+            tunnel.sock.close()
+
+    def write_tunnel(self, link, tunnel_id, tunnel):
+        
+        try:
+            while (data := tunnel.outbound.get()) is not None:
+                tunnel.sock.sendall(data)
+        except OSError as e:
+            if tunnel_id in link.tunnels:
+                logger.error(f"Tunnel {tunnel_id} write failed: {e}")
+            # Wakes the pump, which reports the close to the ship.
+            self.shutdown_tunnel(tunnel)
+
+    def _splice_tunnel(self, link, tunnel_id, tunnel):
+        
+        # Target bytes go socket -> pipe -> ship socket inside the kernel; only
+        # the frame header is written from userspace.
+        target_sock = tunnel.sock
+        read_fd, write_fd = os.pipe()
+        try:
+            while tunnel.flow.wait():
+                try:
+                    n = os.splice(target_sock.fileno(), write_fd, RECV_CHUNK_SIZE)
+                except BlockingIOError:
+                    # The socket timeout makes the fd non-blocking; idle tunnels wait here.
+                    wait_readable(target_sock)
+                    continue
+                if not n:
+                    return
+                splice_frame(link, MSG_TUNNEL_DATA, tunnel_id, read_fd, n)
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def _copy_tunnel(self, link, tunnel_id, tunnel):
         
-        response = f"""HTTP/1.1 {status_code} {status_text}\r
-Content-Type: text/html\r
-Content-Length: 54\r
-\r
-<html><body><h1>{status_code} {status_text}</h1></body></html>"""
-        return response.encode('utf-8')
+        buf = bytearray(RECV_CHUNK_SIZE)
+        view = memoryview(buf)
+        while tunnel.flow.wait():
+            try:
+                n = tunnel.sock.recv_into(buf)
+            except socket.timeout:
+                # Only writes are time-limited; an idle tunnel just keeps waiting.
+                continue
+            if not n:
+                return
+            self.send_message(link, MSG_TUNNEL_DATA, tunnel_id, view[:n])
+
+    def shutdown_tunnel(self, tunnel):
+        
+        # shutdown() rather than close() so the pump and writer threads blocked on the fd wake up.
+        tunnel.flow.close()
+        try:
+            tunnel.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            tunnel.outbound.put_nowait(None)
+        except queue.Full:
+            # The writer is stuck in sendall, and the shutdown above fails it.
+            pass
 
-    def send_message(self, sock, msg_type, payload):
+    def create_error_response(self, status_code, status_text):
         
-        length = len(payload)
-        header = struct.pack('>I', length) + bytes([msg_type])
-        sock.sendall(header + payload)
+        return ERROR_RESPONSES.get((status_code, status_text)) or build_error_response(status_code, status_text)
 
-    def _recv_all(self, sock, length):
+    def send_message(self, link, msg_type, req_id, *parts):
         
-        data = b''
-        while len(data) < length:
-            chunk = sock.recv(length - len(data))
-            if not chunk:
-                return None
-            data += chunk
-        return data
+        header = frame_header(msg_type, req_id, sum(len(part) for part in parts))
+        with link.send_lock:
+            sendmsg_all(link.sock, [header, *parts])
 
     def stop(self):
         
@@ -188,6 +814,13 @@ Content-Length: 54\r
 
     def cleanup(self):
         
+        if self.selector:
+            for key in list(self.selector.get_map().values()):
+                if key.data is not None:
+                    self.close_ship_connection(key.data)
+            self.selector.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.pool.close()
         if self.socket:
             self.socket.close()
             logger.info("Offshore proxy stopped")
@@ -196,10 +829,13 @@ def main():
     parser = argparse.ArgumentParser(description='Offshore Proxy Server')
     parser.add_argument('--host', default='0.0.0.0', help='Host to bind to')
     parser.add_argument('--port', type=int, default=9999, help='Port to bind to')
+    parser.add_argument('--sndbuf', type=int, default=LINK_BUFFER_SIZE, help='Send buffer size of the ship link socket')
+    parser.add_argument('--rcvbuf', type=int, default=LINK_BUFFER_SIZE, help='Receive buffer size of the ship link socket')
+    parser.add_argument('--workers', type=int, default=UPSTREAM_WORKERS, help='Upstream requests handled in parallel')
 
     args = parser.parse_args()
 
-    proxy = OffshoreProxy(args.host, args.port)
+    proxy = OffshoreProxy(args.host, args.port, args.sndbuf, args.rcvbuf, args.workers)
 
     try:
         proxy.start()
@@ -1,284 +1,602 @@
 #!/usr/bin/env python3
 
 
-import socket
-import threading
+import asyncio
+import itertools
 import struct
-import queue
 import logging
 import argparse
-import time
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from socketserver import ThreadingMixIn
-from urllib.parse import urlparse
-import ssl
-import io
+import socket
+import sys
+from http import HTTPStatus
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Sized for the bandwidth-delay product of a high-latency satellite link.
+LINK_BUFFER_SIZE = 12 * 1024 * 1024
+# Cap unsent data queued in the kernel so one bulk request can't delay later frames.
+LINK_NOTSENT_LOWAT = 64 * 1024
+# Probe an idle link after 30 s and give up after 3 unanswered probes 10 s apart.
+LINK_KEEPIDLE = 30
+LINK_KEEPINTVL = 10
+LINK_KEEPCNT = 3
+
+RECV_CHUNK_SIZE = 64 * 1024
+
+# Give up on a client that accepts no response bytes for this long.
+CLIENT_WRITE_TIMEOUT = 60
+# A client this far behind on a tunnel or streamed response has the offshore side
+# paused until it has caught up halfway; past BUFFER_LIMIT it is dropped instead.
+FLOW_PAUSE_BYTES = 1024 * 1024
+BUFFER_LIMIT = 16 * 1024 * 1024
+# Longest a client handler waits for the next frame from the offshore side
+# before checking that its response or tunnel is still alive.
+LINK_WAIT_TIMEOUT = 60
+
+MSG_REQUEST = 0
+MSG_RESPONSE = 1
+MSG_BODY = 2
+MSG_TUNNEL_OPEN = 3
+MSG_TUNNEL_DATA = 4
+MSG_TUNNEL_CLOSE = 5
+# Status line and headers only; the body follows as MSG_BODY frames ended by an empty one.
+MSG_RESPONSE_HEAD = 6
+# Ship -> offshore flow control for one tunnel or streamed response, keyed by its id.
+MSG_PAUSE = 7
+MSG_RESUME = 8
+# Ship -> offshore: the client has gone, so stop answering this request.
+MSG_CANCEL = 9
+
+# 4-byte length, 1-byte type, 4-byte request id; tunnels reuse their CONNECT's id.
+FRAME_HEADER = struct.Struct('>IBI')
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+
+SUPPORTED_METHODS = {'GET', 'POST', 'PUT', 'DELETE', 'HEAD', 'OPTIONS', 'CONNECT'}
+
+def set_nodelay(writer):
+
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+def reset_connection(writer):
+
+    # A zero linger time makes close() send RST instead of FIN.
+    # Skipped once the transport is closing: a client that reset us has already
+    # closed the socket, and the linger option would fail with EBADF.
+    sock = writer.get_extra_info('socket')
+    if sock is not None and not writer.transport.is_closing():
+        linger = struct.pack('HH' if sys.platform == 'win32' else 'ii', 1, 0)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, linger)
+    writer.transport.abort()
+
+def set_keepalive(sock):
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, LINK_KEEPIDLE)
+    elif hasattr(socket, 'TCP_KEEPALIVE'):
+        # macOS name for the idle time.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, LINK_KEEPIDLE)
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, LINK_KEEPINTVL)
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, LINK_KEEPCNT)
+
 class RequestItem:
-    
-    def __init__(self, handler, method, url, headers, body):
-        self.handler = handler
+
+    def __init__(self, req_id, method, url, headers, body, tunnel=False):
+        self.req_id = req_id
         self.method = method
         self.url = url
         self.headers = headers
         self.body = body
-        self.response_event = threading.Event()
-        self.response = None
-        self.error = None
+        self.tunnel = tunnel
+        self.future = asyncio.get_running_loop().create_future()
+
+class ResponseStream:
+
+    def __init__(self, head):
+        self.chunks = asyncio.Queue()
+        self.chunks.put_nowait(head)
+        # Bytes queued here but not yet handed to the client's transport.
+        self.buffered = len(head)
+        self.paused = False
+        # Set by the final empty MSG_BODY; anything else ending the stream is a cut-off.
+        self.complete = False
+
+    def put(self, chunk):
+
+        self.buffered += len(chunk)
+        self.chunks.put_nowait(chunk)
+
+    def abort(self):
+
+        # Free the queued body now rather than when the client wakes up.
+        while not self.chunks.empty():
+            self.chunks.get_nowait()
+        self.buffered = 0
+        self.chunks.put_nowait(None)
+
+class Tunnel:
+
+    def __init__(self):
+        self.chunks = asyncio.Queue()
+        # Bytes queued here but not yet handed to the client's transport.
+        self.buffered = 0
+        self.paused = False
+
+    def abort(self):
+
+        # Free the queued data now rather than when the client wakes up.
+        while not self.chunks.empty():
+            self.chunks.get_nowait()
+        self.buffered = 0
+        self.chunks.put_nowait(None)
 
 class ShipProxy:
-    def __init__(self, offshore_host='localhost', offshore_port=9999):
+    def __init__(self, offshore_host='localhost', offshore_port=9999, sndbuf=LINK_BUFFER_SIZE, rcvbuf=LINK_BUFFER_SIZE):
         self.offshore_host = offshore_host
         self.offshore_port = offshore_port
-        self.request_queue = queue.Queue()
-        self.tcp_sock = None
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+        self.request_queue = asyncio.Queue()
+        self.reader = None
+        self.writer = None
         self.connected = False
         self.running = False
-        self.processor_thread = None
+        self.processor_task = None
+        self.reader_task = None
+        self.pending = {}
+        # Streamed responses still receiving MSG_BODY frames.
+        self.streams = {}
+        self.tunnels = {}
+        self.request_ids = itertools.count(1)
+
+    async def start(self):
 
-    def start(self):
-        
         self.running = True
 
-       
-        if not self.connect_to_offshore():
+        if not await self.connect_to_offshore():
             logger.error("Failed to connect to offshore proxy")
             return False
 
-       
-        self.processor_thread = threading.Thread(target=self.process_requests, daemon=True)
-        self.processor_thread.start()
+        self.reader_task = asyncio.create_task(self.read_frames())
+        self.processor_task = asyncio.create_task(self.process_requests())
 
         logger.info("Ship proxy started successfully")
         return True
 
-    def connect_to_offshore(self):
-        
+    async def connect_to_offshore(self):
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            self.tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.tcp_sock.connect((self.offshore_host, self.offshore_port))
+            # Buffer sizes must be set before connecting for the window scale to take effect.
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+            sock.setblocking(False)
+            await asyncio.get_running_loop().sock_connect(sock, (self.offshore_host, self.offshore_port))
+            if hasattr(socket, 'TCP_NOTSENT_LOWAT'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NOTSENT_LOWAT, LINK_NOTSENT_LOWAT)
+            set_keepalive(sock)
+            self.reader, self.writer = await asyncio.open_connection(sock=sock)
+            set_nodelay(self.writer)
             self.connected = True
             logger.info(f"Connected to offshore proxy at {self.offshore_host}:{self.offshore_port}")
             return True
         except Exception as e:
+            sock.close()
             logger.error(f"Failed to connect to offshore proxy: {e}")
             return False
 
-    def process_requests(self):
-        
+    async def process_requests(self):
+
         logger.info("Request processor started")
 
         while self.running:
-            try:
-                
-                request_item = self.request_queue.get(timeout=1)
+            request_item = await self.request_queue.get()
 
-                if not self.connected:
-                    request_item.error = "No connection to offshore proxy"
-                    request_item.response_event.set()
-                    continue
-
-               
-                request_str = self.build_request_string(request_item)
-
-                
-                try:
-                    self.send_message(0, request_str.encode('utf-8'))
-
-                    
-                    response = self.read_response()
-                    request_item.response = response
+            # The client gave up waiting; don't spend link time on it.
+            if request_item.future.done():
+                continue
 
-                except Exception as e:
-                    logger.error(f"Error communicating with offshore proxy: {e}")
-                    request_item.error = str(e)
+            if not self.connected:
+                request_item.future.set_exception(ConnectionError("No connection to offshore proxy"))
+                continue
 
-                
-                request_item.response_event.set()
+            request = self.build_request(request_item)
 
-                
-                self.request_queue.task_done()
+            # Pipelined: the frame goes out now and read_frames() resolves the
+            # future whenever the offshore proxy answers.
+            req_id = request_item.req_id
+            self.pending[req_id] = request_item.future
+            request_item.future.add_done_callback(lambda _, req_id=req_id: self.pending.pop(req_id, None))
 
-            except queue.Empty:
-                continue
+            try:
+                await self.send_message(MSG_TUNNEL_OPEN if request_item.tunnel else MSG_REQUEST, req_id, request)
             except Exception as e:
-                logger.error(f"Error in request processor: {e}")
+                logger.error(f"Error communicating with offshore proxy: {e}")
+                if isinstance(e, ConnectionError):
+                    self.connected = False
+                if not request_item.future.done():
+                    request_item.future.set_exception(e)
 
-    def build_request_string(self, request_item):
-        
-        request_str = f"{request_item.method} {request_item.url} HTTP/1.1\r\n"
+    async def read_frames(self):
 
-        for header, value in request_item.headers.items():
-            request_str += f"{header}: {value}\r\n"
-
-        request_str += "\r\n"
+        try:
+            while True:
+                msg_type, req_id, payload = await self.read_frame()
+
+                if msg_type == MSG_RESPONSE:
+                    stream = self.streams.pop(req_id, None)
+                    if stream is not None:
+                        # The upstream failed after the head went out; all we can do is cut the body short.
+                        logger.warning(f"Response {req_id} failed mid-stream")
+                        stream.chunks.put_nowait(None)
+                        continue
+                    future = self.pending.pop(req_id, None)
+                    if future is not None and not future.done():
+                        future.set_result(payload)
+                elif msg_type == MSG_RESPONSE_HEAD:
+                    future = self.pending.pop(req_id, None)
+                    if future is not None and not future.done():
+                        stream = self.streams[req_id] = ResponseStream(payload)
+                        future.set_result(stream)
+                elif msg_type == MSG_BODY:
+                    stream = self.streams.get(req_id)
+                    if stream is None:
+                        continue
+                    if not payload:
+                        del self.streams[req_id]
+                        stream.complete = True
+                        stream.chunks.put_nowait(None)
+                        continue
+                    stream.put(payload)
+                    if stream.buffered > BUFFER_LIMIT:
+                        # Only reached if the offshore side ignores MSG_PAUSE for too long.
+                        logger.warning(f"Response {req_id} cut off: client fell {stream.buffered} bytes behind")
+                        del self.streams[req_id]
+                        stream.abort()
+                        self.post_message(MSG_CANCEL, req_id)
+                    elif not stream.paused and stream.buffered > FLOW_PAUSE_BYTES:
+                        stream.paused = True
+                        self.post_message(MSG_PAUSE, req_id)
+                elif msg_type == MSG_TUNNEL_DATA:
+                    tunnel = self.tunnels.get(req_id)
+                    if tunnel is None:
+                        continue
+                    tunnel.buffered += len(payload)
+                    if tunnel.buffered > BUFFER_LIMIT:
+                        logger.warning(f"Tunnel {req_id} closed: client fell {tunnel.buffered} bytes behind")
+                        del self.tunnels[req_id]
+                        tunnel.abort()
+                        self.post_message(MSG_TUNNEL_CLOSE, req_id)
+                    else:
+                        tunnel.chunks.put_nowait(payload)
+                        if not tunnel.paused and tunnel.buffered > FLOW_PAUSE_BYTES:
+                            tunnel.paused = True
+                            self.post_message(MSG_PAUSE, req_id)
+                elif msg_type == MSG_TUNNEL_CLOSE:
+                    tunnel = self.tunnels.pop(req_id, None)
+                    if tunnel is not None:
+                        tunnel.chunks.put_nowait(None)
+                else:
+                    logger.warning(f"Unexpected message type: {msg_type}")
+
+        except (asyncio.IncompleteReadError, OSError) as e:
+            # OSError too: a keepalive timeout surfaces as TimeoutError (ETIMEDOUT),
+            # an unreachable host as a plain OSError.
+            logger.error(f"Lost connection to offshore proxy: {e}")
+        finally:
+            # However the reader ends, nothing more will arrive for these.
+            self.connected = False
+            for future in list(self.pending.values()):
+                if not future.done():
+                    future.set_exception(ConnectionError("Lost connection to offshore proxy"))
+            self.pending.clear()
+            for stream in self.streams.values():
+                stream.chunks.put_nowait(None)
+            self.streams.clear()
+            for tunnel in self.tunnels.values():
+                tunnel.chunks.put_nowait(None)
+            self.tunnels.clear()
+
+    def build_request(self, request_item):
+
+        parts = [f"{request_item.method} {request_item.url} HTTP/1.1\r\n".encode('latin-1')]
+        parts.extend(f"{header}: {value}\r\n".encode('latin-1') for header, value in request_item.headers)
+        parts.append(b"\r\n")
+
+        body = request_item.body
+        if body:
+            parts.append(body if isinstance(body, (bytes, bytearray)) else body.encode('utf-8'))
+
+        return b''.join(parts)
+
+    async def send_message(self, msg_type, req_id, *parts):
+
+        self.post_message(msg_type, req_id, *parts)
+        await self.writer.drain()
+
+    def post_message(self, msg_type, req_id, *parts):
+
+        # Queues the frame without waiting for the link; read_frames uses this
+        # for small control frames so it never stops reading.
+        length = sum(len(part) for part in parts)
+        header = FRAME_HEADER.pack(length, msg_type, req_id)
+        self.writer.writelines([header, *parts])
+
+    async def read_frame(self):
+
+        header = await self.reader.readexactly(FRAME_HEADER_SIZE)
+        length, msg_type, req_id = FRAME_HEADER.unpack(header)
+
+        return msg_type, req_id, await self.reader.readexactly(length)
+
+    def queue_request(self, method, url, headers, body, tunnel=False):
+
+        request_item = RequestItem(next(self.request_ids), method, url, headers, body, tunnel)
+        # Unbounded and single-threaded: put_nowait never blocks and takes no lock.
+        self.request_queue.put_nowait(request_item)
+        return request_item
 
-        if request_item.body:
-            request_str += request_item.body
+    async def stop(self):
 
-        return request_str
+        self.running = False
+        if self.processor_task:
+            self.processor_task.cancel()
+        if self.reader_task:
+            self.reader_task.cancel()
+        if self.writer:
+            self.writer.close()
+        logger.info("Ship proxy stopped")
 
-    def send_message(self, msg_type, payload):
-        
-        length = len(payload)
-        header = struct.pack('>I', length) + bytes([msg_type])
-        self.tcp_sock.sendall(header + payload)
+    async def handle_client(self, reader, writer):
 
-    def read_response(self):
-        
-        header = self._recv_all(5)
-        if not header:
-            raise Exception("Failed to read response header")
+        set_nodelay(writer)
+        try:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
 
-        length = struct.unpack('>I', header[:4])[0]
-        msg_type = header[4]
+            request_line, *header_lines = head[:-4].decode('latin-1').split('\r\n')
+            try:
+                method, url, version = request_line.split(' ', 2)
+            except ValueError:
+                await self.send_error(writer, 400, f"Bad request syntax ({request_line!r})")
+                return
 
-        if msg_type != 1:
-            raise Exception(f"Unexpected message type: {msg_type}")
+            if method not in SUPPORTED_METHODS:
+                await self.send_error(writer, 501, f"Unsupported method ({method!r})")
+                return
 
-        
-        response_data = self._recv_all(length)
-        if not response_data:
-            raise Exception("Failed to read response data")
+            # (name, value) pairs in arrival order; a dict would drop repeated headers.
+            headers = []
+            for line in header_lines:
+                name, _, value = line.partition(':')
+                headers.append((name.strip(), value.strip()))
 
-        return response_data
+            await self.handle_request(writer, method, url, headers, reader)
 
-    def _recv_all(self, length):
-        
-        data = b''
-        while len(data) < length:
-            chunk = self.tcp_sock.recv(length - len(data))
-            if not chunk:
-                return None
-            data += chunk
-        return data
-
-    def queue_request(self, handler, method, url, headers, body):
-        
-        request_item = RequestItem(handler, method, url, headers, body)
-        self.request_queue.put(request_item)
-        return request_item
+        except Exception as e:
+            logger.error(f"Error handling request: {e}")
+            try:
+                await self.send_error(writer, 500, f"Internal Server Error: {str(e)}")
+            except:
+                pass
+        finally:
+            writer.close()
 
-    def stop(self):
-        
-        self.running = False
-        if self.tcp_sock:
-            self.tcp_sock.close()
-        logger.info("Ship proxy stopped")
+    async def handle_request(self, writer, method, url, headers, reader):
 
-class ProxyHTTPRequestHandler(BaseHTTPRequestHandler):
-    
+        body = b""
+        content_length = next((value for name, value in headers if name.lower() == 'content-length'), None)
+        if content_length is not None:
+            body = await self.read_body(reader, int(content_length))
 
-    def __init__(self, *args, ship_proxy=None, **kwargs):
-        self.ship_proxy = ship_proxy
-        super().__init__(*args, **kwargs)
+        logger.info(f"Handling {method} request to {url}")
 
-    def do_GET(self):
-        self.handle_request('GET')
+        if method == 'CONNECT':
+            await self.handle_tunnel(reader, writer, url, headers)
+            return
 
-    def do_POST(self):
-        self.handle_request('POST')
+        request_item = self.queue_request(method, url, headers, body)
 
-    def do_PUT(self):
-        self.handle_request('PUT')
+        try:
+            response = await asyncio.wait_for(request_item.future, timeout=60)
+        except asyncio.TimeoutError:
+            # The offshore side may still be fetching it; spare it the work.
+            if self.connected:
+                self.post_message(MSG_CANCEL, request_item.req_id)
+            await self.send_error(writer, 504, "Gateway Timeout")
+            return
+        except Exception as e:
+            await self.send_error(writer, 502, f"Proxy Error: {e}")
+            return
 
-    def do_DELETE(self):
-        self.handle_request('DELETE')
+        if isinstance(response, ResponseStream):
+            await self.forward_response(writer, request_item.req_id, response)
+            return
 
-    def do_HEAD(self):
-        self.handle_request('HEAD')
+        if not response:
+            await self.send_error(writer, 504, "Gateway Timeout")
+            return
 
-    def do_OPTIONS(self):
-        self.handle_request('OPTIONS')
+        writer.write(response)
+        await writer.drain()
 
-    def do_CONNECT(self):
-        self.handle_request('CONNECT')
+    async def forward_response(self, writer, req_id, stream):
 
-    def handle_request(self, method):
-        
+        # Chunks go to the client as they arrive instead of being joined into one buffer.
         try:
-           
-            url = self.path
-            headers = dict(self.headers)
-
-            
-            body = ""
-            if 'Content-Length' in headers:
-                content_length = int(headers['Content-Length'])
-                body = self.rfile.read(content_length).decode('utf-8')
-
-            logger.info(f"Handling {method} request to {url}")
+            while (chunk := await asyncio.wait_for(stream.chunks.get(), timeout=LINK_WAIT_TIMEOUT)) is not None:
+                stream.buffered -= len(chunk)
+                if stream.paused and stream.buffered <= FLOW_PAUSE_BYTES // 2 and req_id in self.streams and self.connected:
+                    stream.paused = False
+                    self.post_message(MSG_RESUME, req_id)
+                writer.write(chunk)
+                await asyncio.wait_for(writer.drain(), timeout=CLIENT_WRITE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Response {req_id} cut off: client stopped reading or the link went quiet")
+        finally:
+            # Still registered means the offshore side is still sending; tell it to stop.
+            if self.streams.pop(req_id, None) is not None and self.connected:
+                self.post_message(MSG_CANCEL, req_id)
+            if not stream.complete:
+                # Reset rather than close, or a close-delimited body would look complete.
+                reset_connection(writer)
+
+    async def read_body(self, reader, length):
+
+        # Fill a buffer of the final size chunk by chunk; readexactly() would
+        # accumulate the whole body in the stream buffer and then copy it out.
+        body = bytearray(length)
+        view = memoryview(body)
+        offset = 0
+        while offset < length:
+            chunk = await reader.read(min(length - offset, RECV_CHUNK_SIZE))
+            if not chunk:
+                raise asyncio.IncompleteReadError(bytes(view[:offset]), length)
+            view[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+        return body
 
-            
-            request_item = self.ship_proxy.queue_request(self, method, url, headers, body)
+    async def handle_tunnel(self, reader, writer, url, headers):
 
-            
-            request_item.response_event.wait(timeout=60)  
+        request_item = self.queue_request('CONNECT', url, headers, b"", tunnel=True)
+        tunnel_id = request_item.req_id
+        tunnel = Tunnel()
+        self.tunnels[tunnel_id] = tunnel
+        refused = False
 
-            if request_item.error:
-                self.send_error(502, f"Proxy Error: {request_item.error}")
+        try:
+            try:
+                response = await asyncio.wait_for(request_item.future, timeout=60)
+            except asyncio.TimeoutError:
+                await self.send_error(writer, 504, "Gateway Timeout")
                 return
-
-            if not request_item.response:
-                self.send_error(504, "Gateway Timeout")
+            except Exception as e:
+                await self.send_error(writer, 502, f"Proxy Error: {e}")
                 return
 
-            
-            self.wfile.write(request_item.response)
+            writer.write(response)
+            await writer.drain()
 
-        except Exception as e:
-            logger.error(f"Error handling request: {e}")
+            status = response.split(b' ', 2)[1:2]
+            if status != [b'200']:
+                refused = True
+                return
+
+            downstream = asyncio.create_task(self.forward_tunnel(tunnel_id, tunnel, writer))
             try:
-                self.send_error(500, f"Internal Server Error: {str(e)}")
-            except:
+                while tunnel_id in self.tunnels:
+                    data = await reader.read(RECV_CHUNK_SIZE)
+                    if not data:
+                        break
+                    await self.send_message(MSG_TUNNEL_DATA, tunnel_id, data)
+            except ConnectionError:
                 pass
+            finally:
+                tunnel.chunks.put_nowait(None)
+                await downstream
+
+        finally:
+            # Closing either side tears down the whole tunnel. Also sent when the
+            # CONNECT timed out, since the offshore side may still open it later.
+            if self.tunnels.pop(tunnel_id, None) is not None and not refused and self.connected:
+                await self.send_message(MSG_TUNNEL_CLOSE, tunnel_id)
 
-    def log_message(self, format, *args):
-        
-        logger.info(f"HTTP: {format % args}")
+    async def forward_tunnel(self, tunnel_id, tunnel, writer):
 
-class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
-    
-    daemon_threads = True
+        try:
+            while True:
+                try:
+                    data = await asyncio.wait_for(tunnel.chunks.get(), timeout=LINK_WAIT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # Idle tunnels are normal; only a dead link or a dropped tunnel ends it.
+                    if self.connected and tunnel_id in self.tunnels:
+                        continue
+                    break
+                if data is None:
+                    break
+                tunnel.buffered -= len(data)
+                if tunnel.paused and tunnel.buffered <= FLOW_PAUSE_BYTES // 2 and tunnel_id in self.tunnels and self.connected:
+                    tunnel.paused = False
+                    self.post_message(MSG_RESUME, tunnel_id)
+                writer.write(data)
+                await asyncio.wait_for(writer.drain(), timeout=CLIENT_WRITE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Tunnel {tunnel_id} closed: client stopped reading")
+        except ConnectionError:
+            pass
+        finally:
+            # Also ends the upstream loop in handle_tunnel, which tells the offshore side.
+            writer.close()
+
+    async def send_error(self, writer, code, message):
+
+        status = HTTPStatus(code)
+        body = f"<html><body><h1>{code} {status.phrase}</h1><p>{message}</p></body></html>".encode('utf-8', 'replace')
+        logger.info(f"HTTP: code {code}, message {message}")
+        writer.write(
+            f"HTTP/1.1 {code} {status.phrase}\r\n"
+            f"Content-Type: text/html\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode('latin-1', 'replace') + body
+        )
+        await writer.drain()
+
+def install_event_loop_policy():
+
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    elif uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    else:
+        logger.info("uvloop not installed, using the default asyncio event loop")
+
+async def serve(args):
+
+    ship_proxy = ShipProxy(args.offshore_host, args.offshore_port, args.sndbuf, args.rcvbuf)
+
+    if not await ship_proxy.start():
+        logger.error("Failed to start ship proxy")
+        return
 
-def create_handler_class(ship_proxy):
-    
-    class Handler(ProxyHTTPRequestHandler):
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, ship_proxy=ship_proxy, **kwargs)
-    return Handler
+    server = await asyncio.start_server(ship_proxy.handle_client, '0.0.0.0', args.proxy_port)
+
+    logger.info(f"Ship proxy listening on port {args.proxy_port}")
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await ship_proxy.stop()
 
 def main():
     parser = argparse.ArgumentParser(description='Ship Proxy Client')
     parser.add_argument('--offshore-host', default='localhost', help='Offshore proxy host')
     parser.add_argument('--offshore-port', type=int, default=9999, help='Offshore proxy port')
     parser.add_argument('--proxy-port', type=int, default=8080, help='Local proxy port')
+    parser.add_argument('--sndbuf', type=int, default=LINK_BUFFER_SIZE, help='Send buffer size of the offshore link socket')
+    parser.add_argument('--rcvbuf', type=int, default=LINK_BUFFER_SIZE, help='Receive buffer size of the offshore link socket')
 
     args = parser.parse_args()
 
-    
-    ship_proxy = ShipProxy(args.offshore_host, args.offshore_port)
-
-    if not ship_proxy.start():
-        logger.error("Failed to start ship proxy")
-        return
-
-    
-    handler_class = create_handler_class(ship_proxy)
-    httpd = ThreadingHTTPServer(('0.0.0.0', args.proxy_port), handler_class)
-
-    logger.info(f"Ship proxy listening on port {args.proxy_port}")
+    install_event_loop_policy()
 
     try:
-        httpd.serve_forever()
+        asyncio.run(serve(args))
     except KeyboardInterrupt:
         logger.info("Shutting down ship proxy...")
-        ship_proxy.stop()
-        httpd.shutdown()
 
 if __name__ == '__main__':
     main()